@@ -312,6 +312,15 @@ def find_note_by_svg_position(piece_id):
                 'error': 'measure, beat, and voice are required'
             }), 400
         
+        try:
+            beat = float(beat)
+            tolerance = float(tolerance)
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'beat and tolerance must be numbers'
+            }), 400
+        
         db = PiecesDB()
         
         # Verify piece exists
@@ -337,10 +346,10 @@ def find_note_by_svg_position(piece_id):
                    ABS(beat - ?) as beat_distance
             FROM notes 
             WHERE piece_id = ? AND note_set_id = ? AND voice = ? AND measure = ? 
-              AND ABS(beat - ?) <= ?
+              AND beat BETWEEN ? AND ?
             ORDER BY beat_distance ASC
             LIMIT 1
-        """, (beat, piece_id, note_set_id, voice, measure, beat, tolerance))
+        """, (beat, piece_id, note_set_id, voice, measure, beat - tolerance, beat + tolerance))
         
         row = cursor.fetchone()
         conn.close()
@@ -504,6 +513,15 @@ def search_notes_by_osmd_data(piece_id):
                 'error': 'measure, beat, and part_id (or voice) are required'
             }), 400
         
+        try:
+            beat = float(beat)
+            tolerance = float(tolerance)
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'beat and tolerance must be numbers'
+            }), 400
+        
         db = PiecesDB()
         
         # Verify piece exists
@@ -529,10 +547,10 @@ def search_notes_by_osmd_data(piece_id):
         cursor.execute("""
             SELECT * FROM notes 
             WHERE piece_id = ? AND note_set_id = 1 AND voice = ? AND measure = ? 
-              AND ABS(beat - ?) <= ?
+              AND beat BETWEEN ? AND ?
             ORDER BY ABS(beat - ?) ASC
             LIMIT 1
-        """, (piece_id, part_id, measure, beat, tolerance, beat))
+        """, (piece_id, part_id, measure, beat - tolerance, beat + tolerance, beat))
         
         row = cursor.fetchone()
         if row:
@@ -544,10 +562,10 @@ def search_notes_by_osmd_data(piece_id):
         cursor.execute("""
             SELECT * FROM notes 
             WHERE piece_id = ? AND note_set_id = 2 AND voice = ? AND measure = ? 
-              AND ABS(beat - ?) <= ?
+              AND beat BETWEEN ? AND ?
             ORDER BY ABS(beat - ?) ASC
             LIMIT 1
-        """, (piece_id, part_id, measure, beat, tolerance, beat))
+        """, (piece_id, part_id, measure, beat - tolerance, beat + tolerance, beat))
         
         row = cursor.fetchone()
         if row:
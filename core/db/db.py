@@ -1,6 +1,6 @@
 import sqlite3
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 class PiecesDB:
     def __init__(self, db_path=None):
@@ -304,13 +304,34 @@ class PiecesDB:
         
         return success_count
     
-    def get_notes_for_piece(self, piece_id: int) -> List[Dict]:
-        """Get all notes for a specific piece"""
+    def count_notes_for_piece(self, piece_id: int) -> int:
+        """Count the notes stored for a piece"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             
-            cursor.execute("SELECT * FROM notes WHERE piece_id = ? ORDER BY onset", (piece_id,))
+            cursor.execute("SELECT COUNT(*) FROM notes WHERE piece_id = ?", (piece_id,))
+            count = cursor.fetchone()[0]
+            conn.close()
+            
+            return count
+            
+        except sqlite3.Error as e:
+            print(f"Database error counting notes for piece {piece_id}: {e}")
+            if conn:
+                conn.close()
+            return 0
+    
+    def get_notes_for_piece(self, piece_id: int, *, limit: Optional[int] = None) -> List[Dict]:
+        """Get all notes for a specific piece, or only the first `limit` by onset"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            
+            if limit is None:
+                cursor.execute("SELECT * FROM notes WHERE piece_id = ? ORDER BY onset", (piece_id,))
+            else:
+                cursor.execute("SELECT * FROM notes WHERE piece_id = ? ORDER BY onset LIMIT ?", (piece_id, limit))
             rows = cursor.fetchall()
             
             columns = [description[0] for description in cursor.description]
@@ -296,7 +296,7 @@ def convert_melodic_intervals_to_list(melodic_df: pd.DataFrame, piece_id: int, m
     return intervals_list
 
 def create_melodic_intervals_table():
-    """Create a table for storing melodic intervals in the database"""
+    """Create a table for storing melodic intervals in the database (most indexes are built after loading)"""
     db = PiecesDB()
     
     create_table_sql = """
@@ -304,6 +304,7 @@ def create_melodic_intervals_table():
         interval_id INTEGER PRIMARY KEY AUTOINCREMENT,
         piece_id INTEGER NOT NULL,
         melodic_interval_set_id INTEGER NOT NULL,
+        note_id INTEGER,                 -- Reference to the starting note of this interval
         voice INTEGER NOT NULL,
         onset REAL NOT NULL,             -- Interval onset time
         interval_type TEXT,              -- CRIM raw output (P1, m2, M3 or 1, 2, 3)
@@ -311,13 +312,13 @@ def create_melodic_intervals_table():
         
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (piece_id) REFERENCES pieces (piece_id) ON DELETE CASCADE,
-        FOREIGN KEY (melodic_interval_set_id) REFERENCES melodic_interval_sets (set_id) ON DELETE CASCADE
+        FOREIGN KEY (melodic_interval_set_id) REFERENCES melodic_interval_sets (set_id) ON DELETE CASCADE,
+        FOREIGN KEY (note_id) REFERENCES notes (note_id) ON DELETE CASCADE
     );
     
-    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_piece ON melodic_intervals(piece_id);
-    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_set ON melodic_intervals(melodic_interval_set_id);
-    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_voice ON melodic_intervals(voice);
-    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_onset ON melodic_intervals(onset);
+    -- Needed during ingestion: melodic_intervals_exist_for_piece_and_set
+    -- probes every (piece, set) pair, so this one is not deferred
+    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_piece_set ON melodic_intervals(piece_id, melodic_interval_set_id);
     """
     
     try:
@@ -334,6 +335,44 @@ def create_melodic_intervals_table():
             conn.close()
         raise
 
+def create_melodic_intervals_indexes():
+    """Build the melodic_intervals indexes once the table has been populated"""
+    db = PiecesDB()
+    
+    # One sorted build per index after the bulk insert is cheaper than
+    # maintaining the indexes on every inserted row (the list matches the
+    # deferred indexes named in database/schema.sql). Lookups go by
+    # (piece_id, voice, onset), so one composite index (same name as in
+    # ingest_notes.py) replaces the single-column piece, voice and onset ones
+    create_indexes_sql = """
+    BEGIN IMMEDIATE;
+    
+    DROP INDEX IF EXISTS idx_melodic_intervals_piece;
+    DROP INDEX IF EXISTS idx_melodic_intervals_voice;
+    DROP INDEX IF EXISTS idx_melodic_intervals_onset;
+    
+    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_lookup ON melodic_intervals(piece_id, voice, onset);
+    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_set ON melodic_intervals(melodic_interval_set_id);
+    CREATE INDEX IF NOT EXISTS idx_melodic_intervals_note ON melodic_intervals(note_id);
+    
+    COMMIT;
+    """
+    
+    try:
+        import sqlite3
+        conn = sqlite3.connect(db.db_path, isolation_level=None)
+        cursor = conn.cursor()
+        cursor.executescript(create_indexes_sql)
+        conn.close()
+        print("Melodic intervals indexes created successfully")
+    except Exception as e:
+        print(f"Error creating melodic intervals indexes: {e}")
+        if 'conn' in locals():
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+        raise
+
 def insert_melodic_intervals_batch(intervals_list: List[Dict]) -> int:
     """Insert a batch of melodic intervals into the database"""
     if not intervals_list:
@@ -383,12 +422,14 @@ def melodic_intervals_exist_for_piece_and_set(piece_id: int, melodic_set_id: int
         conn = sqlite3.connect(db.db_path)
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT COUNT(*) FROM melodic_intervals 
-            WHERE piece_id = ? AND melodic_interval_set_id = ?
+            SELECT EXISTS(
+                SELECT 1 FROM melodic_intervals 
+                WHERE piece_id = ? AND melodic_interval_set_id = ?
+            )
         """, (piece_id, melodic_set_id))
-        count = cursor.fetchone()[0]
+        exists = bool(cursor.fetchone()[0])
         conn.close()
-        return count > 0
+        return exists
     except Exception as e:
         print(f"Error checking melodic intervals existence: {e}")
         if 'conn' in locals():
@@ -547,6 +588,10 @@ def ingest_melodic_intervals_for_all_pieces():
     print(f"Total errors: {error_count}")
     print(f"Total melodic intervals inserted: {total_intervals}")
     
+    # Indexes are built once, after all sets have been inserted
+    print(f"\n=== Creating melodic intervals indexes ===")
+    create_melodic_intervals_indexes()
+    
     # Print cache statistics
     print(f"\n=== Cache Statistics ===")
     stats = cache_manager.get_cache_stats()
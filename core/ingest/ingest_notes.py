@@ -326,6 +326,12 @@ def create_optimal_indexes():
             ON notes(piece_id, note_set_id)
         """)
         
+        # Position lookups (voice, measure, beat range) from the API
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notes_position 
+            ON notes(piece_id, note_set_id, voice, measure, beat)
+        """)
+        
         # Indexes for analysis tables (for JOIN operations)
         print("  Creating analysis table indexes...")
         
@@ -1,5 +1,8 @@
 import os
 import hashlib
+import importlib.util
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import List, Dict
 import sys
@@ -9,14 +12,26 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from db.db import PiecesDB
 from crim_cache_manager import cache_manager
 
-# Import music21 for metadata extraction
-try:
-    from music21 import converter
-    MUSIC21_AVAILABLE = True
-except ImportError:
+# music21 is needed for metadata extraction, but is only imported on the first
+# parse: pieces served from the stage cache never pay for loading it
+MUSIC21_AVAILABLE = importlib.util.find_spec('music21') is not None
+if not MUSIC21_AVAILABLE:
     print("Error: music21 library is required but not available.")
     print("Please install music21: pip install music21")
-    MUSIC21_AVAILABLE = False
+
+# Most recently parsed score, keyed by path: title and composer extraction for
+# the same file share one music21 parse (only one score is kept in memory)
+_LAST_SCORE = {}
+
+def _parse_score(file_path: str):
+    """Parse a file with music21, reusing the score if it was the last one parsed"""
+    score = _LAST_SCORE.get(file_path)
+    if score is None:
+        from music21 import converter
+        score = converter.parse(file_path)
+        _LAST_SCORE.clear()
+        _LAST_SCORE[file_path] = score
+    return score
 
 def calculate_sha256(file_path: str) -> str:
     """Calculate SHA256 hash of a file"""
@@ -36,8 +51,8 @@ def extract_title(file_path: str) -> str:
         raise ImportError("music21 library is required for metadata extraction")
     
     try:
-        # Use music21 to parse the file and get metadata
-        score = converter.parse(file_path)
+        # Use music21 to parse the file (shared with the other extractor) and get metadata
+        score = _parse_score(file_path)
         
         # Try to get title from metadata
         if score.metadata is not None:
@@ -65,8 +80,8 @@ def extract_composer(file_path: str) -> str:
         raise ImportError("music21 library is required for metadata extraction")
     
     try:
-        # Use music21 to parse the file and get metadata
-        score = converter.parse(file_path)
+        # Use music21 to parse the file (shared with the other extractor) and get metadata
+        score = _parse_score(file_path)
         
         # Try to get composer from metadata
         if score.metadata is not None:
@@ -101,11 +116,12 @@ def get_musicxml_files(directory: str) -> List[str]:
     musicxml_files = []
     
     try:
-        for filename in os.listdir(directory):
-            if filename.endswith('.musicxml') or filename.endswith('.musicxml.xml'):
-                file_path = os.path.join(directory, filename)
-                if os.path.isfile(file_path):
-                    musicxml_files.append(file_path)
+        # scandir entries carry the file type from the directory listing, so
+        # is_file() needs no extra stat() per file
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(('.musicxml', '.musicxml.xml')) and entry.is_file():
+                    musicxml_files.append(entry.path)
         
         print(f"Found {len(musicxml_files)} MusicXML files in {directory}")
         return musicxml_files
@@ -114,34 +130,36 @@ def get_musicxml_files(directory: str) -> List[str]:
         print(f"Error reading directory {directory}: {e}")
         return []
 
-def process_piece(file_path: str, data_root: str) -> Dict:
-    """Process a single piece file and return data dict"""
+def load_cached_piece(file_path: str) -> Dict:
+    """Return the cached data dict for a piece file, or None if missing or outdated"""
+    filename = os.path.basename(file_path)
+    piece_key = cache_manager._get_piece_key(filename)
+    cached_data = cache_manager.load_stage_cache('pieces', 'pkl', 'default', piece_key)
+    
+    if cached_data is not None:
+        metadata = cached_data.get('metadata', {})
+        print(f"  Loading from cache: {filename}")
+        # Verify the cached data is still valid by checking file modification time
+        try:
+            cached_mtime = metadata.get('file_mtime', 0)
+            current_mtime = os.path.getmtime(file_path)
+            if abs(current_mtime - cached_mtime) < 1:  # Within 1 second tolerance
+                return metadata
+            else:
+                print(f"  Cache outdated for {filename}, reprocessing...")
+        except:
+            print(f"  Cache validation failed for {filename}, reprocessing...")
+    
+    return None
+
+def extract_piece_data(file_path: str, data_root: str) -> Dict:
+    """Extract the data dict of a piece file, without touching the cache"""
     try:
         # Calculate relative path from data directory
         rel_path = os.path.relpath(file_path, data_root)
         filename = os.path.basename(file_path)
         
-        # Try to load from cache first
-        piece_key = cache_manager._get_piece_key(filename)
-        cached_data = cache_manager.load_stage_cache('pieces', 'pkl', 'default', piece_key)
-        
-        if cached_data is not None:
-            metadata = cached_data.get('metadata', {})
-            print(f"  Loading from cache: {filename}")
-            # Verify the cached data is still valid by checking file modification time
-            try:
-                cached_mtime = metadata.get('file_mtime', 0)
-                current_mtime = os.path.getmtime(file_path)
-                if abs(current_mtime - cached_mtime) < 1:  # Within 1 second tolerance
-                    return metadata
-                else:
-                    print(f"  Cache outdated for {filename}, reprocessing...")
-            except:
-                print(f"  Cache validation failed for {filename}, reprocessing...")
-        
-        # Process the piece if not in cache or cache is invalid
-        print(f"  Processing: {filename}")
-        piece_data = {
+        return {
             'path': rel_path,
             'filename': filename,
             'title': extract_title(file_path),
@@ -151,8 +169,28 @@ def process_piece(file_path: str, data_root: str) -> Dict:
             'processed_at': datetime.now().isoformat()
         }
         
-        # Save to cache
-        cache_manager.save_stage_cache('pieces', 'pkl', 'default', piece_key, {}, piece_data)
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+        return None
+
+def save_piece_cache(piece_data: Dict):
+    """Save a freshly extracted piece data dict to the stage cache"""
+    piece_key = cache_manager._get_piece_key(piece_data['filename'])
+    cache_manager.save_stage_cache('pieces', 'pkl', 'default', piece_key, {}, piece_data)
+
+def process_piece(file_path: str, data_root: str) -> Dict:
+    """Process a single piece file and return data dict"""
+    try:
+        # Try to load from cache first
+        piece_data = load_cached_piece(file_path)
+        if piece_data is not None:
+            return piece_data
+        
+        # Process the piece if not in cache or cache is invalid
+        print(f"  Processing: {os.path.basename(file_path)}")
+        piece_data = extract_piece_data(file_path, data_root)
+        if piece_data is not None:
+            save_piece_cache(piece_data)
         
         return piece_data
         
@@ -199,13 +237,41 @@ def ingest_pieces_from_directory(test_dir: str = None):
     skipped_count = 0
     error_count = 0
     
-    # Process each file
+    # Cache lookups run here first: the cache manager keeps its index in
+    # memory and rewrites cache_index.json in full, so only this process
+    # may read or write it
+    piece_results = {}
+    to_extract = []
     for file_path in musicxml_files:
+        print(f"Processing: {os.path.basename(file_path)}")
         try:
-            print(f"Processing: {os.path.basename(file_path)}")
-            
-            # Process the piece
-            piece_data = process_piece(file_path, data_root)
+            piece_data = load_cached_piece(file_path)
+        except Exception as e:
+            print(f"Error processing file {file_path}: {e}")
+            piece_data = None
+        if piece_data is not None:
+            piece_results[file_path] = piece_data
+        else:
+            to_extract.append(file_path)
+    
+    # music21 parsing is CPU-bound, so uncached files are extracted in
+    # parallel worker processes; the extracted pieces are cached here
+    if to_extract:
+        print(f"Extracting {len(to_extract)} uncached pieces...")
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            extracted = executor.map(extract_piece_data, to_extract, itertools.repeat(data_root))
+            for file_path, piece_data in zip(to_extract, extracted):
+                if piece_data is not None:
+                    try:
+                        save_piece_cache(piece_data)
+                    except Exception as e:
+                        print(f"Error caching {file_path}: {e}")
+                piece_results[file_path] = piece_data
+    
+    # Database checks and inserts, in file order
+    for file_path in musicxml_files:
+        try:
+            piece_data = piece_results[file_path]
             
             if piece_data is None:
                 error_count += 1
@@ -224,7 +290,7 @@ def ingest_pieces_from_directory(test_dir: str = None):
                 processed_count += 1
             else:
                 error_count += 1
-                
+            
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
             error_count += 1
@@ -77,6 +77,8 @@ CREATE INDEX IF NOT EXISTS idx_notes_onset ON notes(onset);
 CREATE INDEX IF NOT EXISTS idx_notes_pitch ON notes(pitch);
 CREATE INDEX IF NOT EXISTS idx_notes_type ON notes(type);
 CREATE INDEX IF NOT EXISTS idx_notes_is_entry ON notes(is_entry);
+CREATE INDEX IF NOT EXISTS idx_notes_lookup ON notes(piece_id, voice, onset);
+CREATE INDEX IF NOT EXISTS idx_notes_position ON notes(piece_id, note_set_id, voice, measure, beat); -- position (measure/beat) lookups
 
 -- Table: parameter_sets
 CREATE TABLE IF NOT EXISTS parameter_sets (
@@ -107,11 +109,10 @@ CREATE TABLE IF NOT EXISTS melodic_intervals (
 );
 
 -- Indexes for melodic_intervals table
-CREATE INDEX IF NOT EXISTS idx_melodic_intervals_piece ON melodic_intervals(piece_id);
-CREATE INDEX IF NOT EXISTS idx_melodic_intervals_set ON melodic_intervals(melodic_interval_set_id);
-CREATE INDEX IF NOT EXISTS idx_melodic_intervals_note ON melodic_intervals(note_id);
-CREATE INDEX IF NOT EXISTS idx_melodic_intervals_voice ON melodic_intervals(voice);
-CREATE INDEX IF NOT EXISTS idx_melodic_intervals_onset ON melodic_intervals(onset);
+-- (idx_melodic_intervals_lookup (piece_id, voice, onset), idx_melodic_intervals_set (melodic_interval_set_id)
+--  and idx_melodic_intervals_note (note_id) are built after loading by create_melodic_intervals_indexes
+--  in core/ingest/ingest_melodic_intervals.py)
+CREATE INDEX IF NOT EXISTS idx_melodic_intervals_piece_set ON melodic_intervals(piece_id, melodic_interval_set_id);
 
 -- Table: melodic_ngrams
 CREATE TABLE IF NOT EXISTS melodic_ngrams (
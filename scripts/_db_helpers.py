@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Database and onset matching helpers shared by the note matching test scripts.
+"""
+
+import atexit
+import os
+import sqlite3
+import sys
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# Add the project root to the path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from core.db.db import PiecesDB
+
+# Notes already read per (db_path, piece_id); callers only read the cached DataFrames
+_NOTES_CACHE = {}
+
+# One connection per database file, opened on first use and closed at exit
+_CONNS = {}
+
+def _get_conn(db_path: str) -> sqlite3.Connection:
+    """Return the shared connection for db_path, opening it on first use"""
+    conn = _CONNS.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        atexit.register(conn.close)
+        _CONNS[db_path] = conn
+    return conn
+
+def get_notes_from_db(piece_id: int, db_path: Optional[str] = None) -> pd.DataFrame:
+    """Get all notes for a piece from database as a DataFrame (cached per piece)"""
+    if db_path is None:
+        db_path = PiecesDB().db_path
+
+    cache_key = (db_path, piece_id)
+    if cache_key in _NOTES_CACHE:
+        return _NOTES_CACHE[cache_key]
+
+    try:
+        conn = _get_conn(db_path)
+
+        # One column per field, filtered with vectorized masks by the callers
+        notes = pd.read_sql_query("""
+            SELECT note_id, piece_id, voice, onset, duration, measure, beat,
+                   pitch, name, step, octave, `alter`, type, staff, tie
+            FROM notes
+            WHERE piece_id = ?
+            ORDER BY voice, onset
+        """, conn, params=(piece_id,))
+
+        # Failed reads are not cached, so a later call can retry
+        _NOTES_CACHE[cache_key] = notes
+        return notes
+
+    except Exception as e:
+        print(f"❌ Error retrieving notes: {e}")
+        return pd.DataFrame()
+
+def nearest_onsets(onsets, targets):
+    """Index of and distance to the nearest of the sorted `onsets` for each target"""
+    idx = np.searchsorted(onsets, targets)
+    left = np.clip(idx - 1, 0, len(onsets) - 1)
+    right = np.clip(idx, 0, len(onsets) - 1)
+    left_diff = np.abs(onsets[left] - targets)
+    right_diff = np.abs(onsets[right] - targets)
+    # Ties go to the earlier note, as min() over the sorted notes would
+    use_left = left_diff <= right_diff
+    return np.where(use_left, left, right), np.where(use_left, left_diff, right_diff)
@@ -6,10 +6,26 @@ Script to analyze Verovio SVG output and understand note positioning
 import os
 import sys
 import json
-from xml.etree import ElementTree as ET
+
+# lxml (libxml2) parses and searches in C; the stdlib API is compatible here
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+
+# orjson serializes in native code; fall back to the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Script-relative paths, resolved once at import
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_DATA = os.path.normpath(os.path.join(_HERE, '..', 'data'))
 
 # Add the core directory to the path
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'core'))
+sys.path.append(os.path.join(_HERE, '..', 'core'))
 from db.db import PiecesDB
 
 def analyze_musicxml_structure(piece_id=1):
@@ -29,8 +45,7 @@ def analyze_musicxml_structure(piece_id=1):
         # Get file path
         file_path = piece.get('path')
         if not os.path.isabs(file_path):
-            base_path = os.path.join(os.path.dirname(__file__), '..', 'data')
-            file_path = os.path.join(base_path, file_path)
+            file_path = os.path.join(_DATA, file_path)
         
         file_path = os.path.normpath(file_path)
         
@@ -41,70 +56,80 @@ def analyze_musicxml_structure(piece_id=1):
         print(f"File: {piece['filename']}")
         print(f"Path: {file_path}")
         
-        # Parse MusicXML
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        
-        print(f"Root element: {root.tag}")
-        
-        # Find all parts
-        parts = root.findall('.//part')
-        print(f"Number of parts: {len(parts)}")
-        
+        # Stream the MusicXML: each measure is summarized and cleared as soon as
+        # it has been parsed, so only the current subtree is held in memory
+        root_tag = None
+        part_count = 0
+        measures_in_part = 0
         note_count = 0
         measure_count = 0
         
-        for part_idx, part in enumerate(parts[:2]):  # Analyze first 2 parts
-            part_id = part.get('id', f'part_{part_idx}')
-            print(f"\n--- Part {part_idx + 1} (ID: {part_id}) ---")
+        for event, elem in ET.iterparse(file_path, events=('start', 'end')):
+            if event == 'start':
+                if root_tag is None:
+                    root_tag = elem.tag
+                    print(f"Root element: {root_tag}")
+                elif elem.tag == 'part':
+                    part_idx = part_count
+                    part_count += 1
+                    measures_in_part = 0
+                    if part_idx < 2:  # Analyze first 2 parts
+                        part_id = elem.get('id', f'part_{part_idx}')
+                        print(f"\n--- Part {part_idx + 1} (ID: {part_id}) ---")
+                continue
             
-            measures = part.findall('.//measure')
-            print(f"Measures in this part: {len(measures)}")
-            
-            for measure_idx, measure in enumerate(measures[:3]):  # First 3 measures
-                measure_number = measure.get('number', measure_idx + 1)
-                print(f"\n  Measure {measure_number}:")
-                
-                # Find notes in this measure
-                notes = measure.findall('.//note')
-                print(f"    Notes: {len(notes)}")
+            if elem.tag == 'measure':
+                measure_idx = measures_in_part
+                measures_in_part += 1
                 
-                for note_idx, note in enumerate(notes[:5]):  # First 5 notes per measure
-                    # Extract note information
-                    pitch_elem = note.find('pitch')
-                    staff_elem = note.find('staff')
-                    voice_elem = note.find('voice')
-                    duration_elem = note.find('duration')
+                if part_count <= 2 and measure_idx < 3:  # First 3 measures
+                    measure_number = elem.get('number', measure_idx + 1)
+                    print(f"\n  Measure {measure_number}:")
                     
-                    pitch_info = "Rest"
-                    if pitch_elem is not None:
-                        step = pitch_elem.find('step')
-                        octave = pitch_elem.find('octave')
-                        if step is not None and octave is not None:
-                            pitch_info = f"{step.text}{octave.text}"
-                    
-                    staff_info = staff_elem.text if staff_elem is not None else "1"
-                    voice_info = voice_elem.text if voice_elem is not None else "1"
-                    duration_info = duration_elem.text if duration_elem is not None else "N/A"
+                    # Find notes in this measure
+                    notes = elem.findall('note')
+                    print(f"    Notes: {len(notes)}")
                     
-                    print(f"      Note {note_idx + 1}: {pitch_info}, Staff={staff_info}, Voice={voice_info}, Duration={duration_info}")
+                    for note_idx, note in enumerate(notes[:5]):  # First 5 notes per measure
+                        # Extract note information (findtext: one lookup per field)
+                        step = note.findtext('pitch/step')
+                        octave = note.findtext('pitch/octave')
+                        
+                        pitch_info = "Rest"
+                        if step is not None and octave is not None:
+                            pitch_info = f"{step}{octave}"
+                        
+                        staff_info = note.findtext('staff', "1")
+                        voice_info = note.findtext('voice', "1")
+                        duration_info = note.findtext('duration', "N/A")
+                        
+                        print(f"      Note {note_idx + 1}: {pitch_info}, Staff={staff_info}, Voice={voice_info}, Duration={duration_info}")
+                        
+                        note_count += 1
                     
-                    note_count += 1
+                    measure_count += 1
                 
-                measure_count += 1
+                elem.clear()
+            
+            elif elem.tag == 'part':
+                if part_count <= 2:
+                    print(f"Measures in this part: {measures_in_part}")
+                elem.clear()
+        
+        print(f"\nNumber of parts: {part_count}")
         
         print(f"\n=== Summary ===")
-        print(f"Total parts analyzed: {min(len(parts), 2)}")
+        print(f"Total parts analyzed: {min(part_count, 2)}")
         print(f"Total measures analyzed: {measure_count}")
         print(f"Total notes found: {note_count}")
         
         # Get database notes for comparison
-        notes_db = db.get_notes_for_piece(piece_id)
-        print(f"Notes in database: {len(notes_db)}")
+        notes_count = db.count_notes_for_piece(piece_id)
+        print(f"Notes in database: {notes_count}")
         
-        if len(notes_db) > 0:
+        if notes_count > 0:
             print("\nFirst 5 database notes:")
-            for i, note in enumerate(notes_db[:5]):
+            for i, note in enumerate(db.get_notes_for_piece(piece_id, limit=5)):
                 print(f"  Note {i+1}: onset={note['onset']}, voice={note['voice']}, pitch={note.get('name', 'N/A')}")
         
     except Exception as e:
@@ -121,15 +146,16 @@ def create_test_mapping_data(piece_id=1):
     
     try:
         db = PiecesDB()
-        notes_db = db.get_notes_for_piece(piece_id)
+        # Only the first 10 notes are mapped, so only those are fetched
+        notes_db = db.get_notes_for_piece(piece_id, limit=10)
         
-        print(f"Database notes count: {len(notes_db)}")
+        print(f"Database notes count: {db.count_notes_for_piece(piece_id)}")
         
         # Create a simplified mapping based on note order
         # In reality, we would need to match based on measure, staff, voice, and timing
         mapping_data = []
         
-        for i, note in enumerate(notes_db[:10]):  # First 10 notes for testing
+        for i, note in enumerate(notes_db):  # First 10 notes for testing
             mapping_data.append({
                 'svg_index': i,  # This would be the order in SVG
                 'note_id': note['note_id'],
@@ -150,9 +176,13 @@ def create_test_mapping_data(piece_id=1):
             print(f"  SVG Index {item['svg_index']}: note_id={item['note_id']}, voice={item['voice']}, onset={item['onset']}")
         
         # Save mapping to a test file
-        output_file = os.path.join(os.path.dirname(__file__), 'test_note_mapping.json')
-        with open(output_file, 'w') as f:
-            json.dump(mapping_data, f, indent=2)
+        output_file = os.path.join(_HERE, 'test_note_mapping.json')
+        if ORJSON_AVAILABLE:
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(mapping_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_file, 'w') as f:
+                json.dump(mapping_data, f, indent=2)
         
         print(f"\nMapping data saved to: {output_file}")
         
@@ -172,23 +202,33 @@ def test_note_id_lookup():
     
     try:
         # Import the existing NoteIdUpdater
-        sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'core', 'utils'))
+        sys.path.append(os.path.join(_HERE, '..', 'core', 'utils'))
         from note_id_updater import NoteIdUpdater
         
         updater = NoteIdUpdater()
         
         # Get some sample notes from database to test with
         db = PiecesDB()
-        notes_db = db.get_notes_for_piece(1)
+        sample_notes = db.get_notes_for_piece(1, limit=3)
         
-        if len(notes_db) == 0:
+        if len(sample_notes) == 0:
             print("No notes found in database for piece 1")
             return
         
-        print(f"Testing with {min(len(notes_db), 3)} sample notes:")
+        print(f"Testing with {len(sample_notes)} sample notes:")
+        
+        piece_id = 1  # We know we're testing with piece 1
+        
+        # Resolve exact and shifted (onset+0.0005) lookups in one batch call
+        # instead of one find_note_id round-trip per note
+        records = [
+            {'piece_id': piece_id, 'voice': note['voice'], 'onset': note['onset'] + shift}
+            for shift in (0, 0.0005)
+            for note in sample_notes
+        ]
+        found_map = updater.find_note_ids_batch(records, tolerance=0.001)
         
-        for i, note in enumerate(notes_db[:3]):
-            piece_id = 1  # We know we're testing with piece 1
+        for i, note in enumerate(sample_notes):
             voice = note['voice']
             onset = note['onset']
             expected_note_id = note['note_id']
@@ -197,8 +237,8 @@ def test_note_id_lookup():
             print(f"    Input: piece_id={piece_id}, voice={voice}, onset={onset}")
             print(f"    Expected note_id: {expected_note_id}")
             
-            # Test the lookup
-            found_note_id = updater.find_note_id(piece_id, voice, onset, tolerance=0.001)
+            # Look up the batch result
+            found_note_id = found_map.get((piece_id, voice, onset))
             
             success = found_note_id == expected_note_id
             print(f"    Found note_id: {found_note_id}")
@@ -206,7 +246,7 @@ def test_note_id_lookup():
             
             if success:
                 # Test with slight variation to check tolerance
-                found_with_tolerance = updater.find_note_id(piece_id, voice, onset + 0.0005, tolerance=0.001)
+                found_with_tolerance = found_map.get((piece_id, voice, onset + 0.0005))
                 tolerance_success = found_with_tolerance == expected_note_id
                 print(f"    Tolerance test (onset+0.0005): {'✓ SUCCESS' if tolerance_success else '✗ FAILED'}")
         
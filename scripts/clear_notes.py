@@ -8,12 +8,13 @@ import os
 import sys
 import sqlite3
 
+# Database path, relative to the project root (one level up from scripts/)
+_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'analysis.db')
+
 def clear_notes_table():
     """Clear all notes from the database"""
     
-    # Get project root directory (one level up from scripts/)
-    project_root = os.path.dirname(os.path.dirname(__file__))
-    db_path = os.path.join(project_root, 'database', 'analysis.db')
+    db_path = _DB_PATH
     
     if not os.path.exists(db_path):
         print(f"Error: Database file not found at {db_path}")
@@ -22,6 +23,12 @@ def clear_notes_table():
     try:
         # Connect to database
         conn = sqlite3.connect(db_path)
+        # WAL with NORMAL sync keeps the bulk DELETE from forcing a full
+        # journal fsync; same settings as NoteIdUpdater's connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
         cursor = conn.cursor()
         
         # Get count before deletion
@@ -50,20 +57,15 @@ def clear_notes_table():
         cursor.execute("SELECT COUNT(*) FROM notes")
         count_after = cursor.fetchone()[0]
         
+        # Reset auto-increment counter in the same transaction
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name='notes'")
+        
         # Commit changes
         conn.commit()
         conn.close()
         
         print(f"Successfully deleted {count_before} notes from the database.")
         print(f"Notes table now contains {count_after} records.")
-        
-        # Reset auto-increment counter (optional)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='notes'")
-        conn.commit()
-        conn.close()
-        
         print("Auto-increment counter has been reset.")
         
         return True
@@ -4,6 +4,7 @@ Script to initialize and populate the parameter_sets table with common parameter
 This table stores different combinations of parameters for interval analysis.
 """
 
+import itertools
 import os
 import sys
 import sqlite3
@@ -13,10 +14,12 @@ from typing import List, Dict
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'core'))
 from db.db import PiecesDB
 
-def create_parameter_sets_table():
+# Abbreviations used in parameter set descriptions
+KIND_ABBREVS = {'quality': 'q', 'diatonic': 'd'}
+COMBINE_ABBREVS = {True: 'cT', False: 'cF'}
+
+def create_parameter_sets_table(conn: sqlite3.Connection):
     """Create the parameter_sets table if it doesn't exist"""
-    db = PiecesDB()
-    
     create_table_sql = """
     CREATE TABLE IF NOT EXISTS parameter_sets (
         parameter_set_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,97 +31,77 @@ def create_parameter_sets_table():
         UNIQUE(kind, combine_unisons, number)  -- 确保参数组合唯一
     );
     
-    CREATE INDEX IF NOT EXISTS idx_parameter_sets_kind ON parameter_sets(kind);
+    -- kind lookups use the UNIQUE(kind, combine_unisons, number) index prefix
+    DROP INDEX IF EXISTS idx_parameter_sets_kind;
     CREATE INDEX IF NOT EXISTS idx_parameter_sets_number ON parameter_sets(number);
     CREATE INDEX IF NOT EXISTS idx_parameter_sets_combine_unisons ON parameter_sets(combine_unisons);
     """
     
     try:
-        conn = sqlite3.connect(db.db_path)
         cursor = conn.cursor()
         cursor.executescript(create_table_sql)
         conn.commit()
-        conn.close()
         print("✓ Parameter sets table created successfully")
     except Exception as e:
         print(f"Error creating parameter sets table: {e}")
-        if 'conn' in locals():
-            conn.close()
         raise
 
 def generate_parameter_combinations() -> List[Dict]:
     """Generate all parameter combinations"""
-    combinations = []
-    
     # 参数选项
     kinds = ["quality", "diatonic"]
     combine_unisons_options = [True, False]
-    numbers = list(range(3, 11))  # 3-10
-    
-    for kind in kinds:
-        for combine_unisons in combine_unisons_options:
-            for number in numbers:
-                # 生成描述字符串
-                # 格式: {number}_{kind_abbrev}_{combine_unisons_abbrev}
-                kind_abbrev = "q" if kind == "quality" else "d"
-                combine_abbrev = "cT" if combine_unisons else "cF"
-                description = f"{number}_{kind_abbrev}_{combine_abbrev}"
-                
-                combination = {
-                    'description': description,
-                    'kind': kind,
-                    'combine_unisons': combine_unisons,
-                    'number': number
-                }
-                combinations.append(combination)
-    
-    return combinations
+    numbers = range(3, 11)  # 3-10
+    
+    # 生成描述字符串
+    # 格式: {number}_{kind_abbrev}_{combine_unisons_abbrev}
+    return [
+        {
+            'description': f"{number}_{KIND_ABBREVS[kind]}_{COMBINE_ABBREVS[combine_unisons]}",
+            'kind': kind,
+            'combine_unisons': combine_unisons,
+            'number': number
+        }
+        for kind, combine_unisons, number in itertools.product(kinds, combine_unisons_options, numbers)
+    ]
 
-def insert_parameter_combinations(combinations: List[Dict]) -> int:
+def insert_parameter_combinations(conn: sqlite3.Connection, combinations: List[Dict]) -> int:
     """Insert parameter combinations into the database"""
     if not combinations:
         return 0
     
-    db = PiecesDB()
-    
     insert_sql = """
     INSERT OR IGNORE INTO parameter_sets (description, kind, combine_unisons, number)
     VALUES (?, ?, ?, ?)
     """
     
     try:
-        conn = sqlite3.connect(db.db_path)
         cursor = conn.cursor()
         
-        success_count = 0
-        for combo in combinations:
-            cursor.execute(insert_sql, (
-                combo['description'],
-                combo['kind'],
-                combo['combine_unisons'],
-                combo['number']
-            ))
-            if cursor.rowcount > 0:
-                success_count += 1
-        
+        # All rows in one statement and one transaction; ignored duplicates
+        # don't count as changes, so the total_changes delta is the new rows
+        changes_before = conn.total_changes
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany(insert_sql, [
+            (combo['description'], combo['kind'], combo['combine_unisons'], combo['number'])
+            for combo in combinations
+        ])
         conn.commit()
-        conn.close()
+        
+        success_count = conn.total_changes - changes_before
         return success_count
         
     except Exception as e:
         print(f"Error inserting parameter combinations: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
+        conn.rollback()
         return 0
 
-def get_all_parameter_sets() -> List[Dict]:
+def get_all_parameter_sets(conn: sqlite3.Connection) -> List[Dict]:
     """Get all parameter sets from the database"""
-    db = PiecesDB()
-    
     try:
-        conn = sqlite3.connect(db.db_path)
+        # Row objects are built in C and support access by column name
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute("""
             SELECT parameter_set_id, description, kind, combine_unisons, number
@@ -126,22 +109,17 @@ def get_all_parameter_sets() -> List[Dict]:
             ORDER BY number, kind, combine_unisons
         """)
         
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        parameter_sets = [dict(zip(columns, row)) for row in rows]
+        parameter_sets = [dict(row) for row in cursor.fetchall()]
         
-        conn.close()
         return parameter_sets
         
     except Exception as e:
         print(f"Error retrieving parameter sets: {e}")
-        if 'conn' in locals():
-            conn.close()
         return []
 
-def display_parameter_sets():
+def display_parameter_sets(conn: sqlite3.Connection):
     """Display all parameter sets in a formatted table"""
-    parameter_sets = get_all_parameter_sets()
+    parameter_sets = get_all_parameter_sets(conn)
     
     if not parameter_sets:
         print("No parameter sets found in database.")
@@ -179,22 +157,28 @@ def main():
     print("🔧 Initializing Parameter Sets")
     print("=" * 50)
     
-    # Create table
-    print("Creating parameter sets table...")
-    create_parameter_sets_table()
-    
-    # Generate all combinations
-    print("Generating parameter combinations...")
-    combinations = generate_parameter_combinations()
-    print(f"Generated {len(combinations)} parameter combinations")
-    
-    # Insert combinations
-    print("Inserting parameter combinations into database...")
-    success_count = insert_parameter_combinations(combinations)
-    print(f"✓ Inserted {success_count} new parameter combinations")
-    
-    # Display results
-    display_parameter_sets()
+    # One connection shared by every step instead of an open/close per function
+    db = PiecesDB()
+    conn = sqlite3.connect(db.db_path)
+    try:
+        # Create table
+        print("Creating parameter sets table...")
+        create_parameter_sets_table(conn)
+        
+        # Generate all combinations
+        print("Generating parameter combinations...")
+        combinations = generate_parameter_combinations()
+        print(f"Generated {len(combinations)} parameter combinations")
+        
+        # Insert combinations
+        print("Inserting parameter combinations into database...")
+        success_count = insert_parameter_combinations(conn, combinations)
+        print(f"✓ Inserted {success_count} new parameter combinations")
+        
+        # Display results
+        display_parameter_sets(conn)
+    finally:
+        conn.close()
     
     print(f"\n✨ Parameter sets initialization complete!")
     print(f"You can now reference these parameter sets by their ID or description.")
@@ -6,7 +6,6 @@ This script tests different approaches to extract notes without writing to datab
 
 import os
 import sys
-import pandas as pd
 
 # Test CRIM intervals import
 try:
@@ -42,6 +41,14 @@ except ImportError as e:
     print(f"✗ Failed to import crim_intervals: {e}")
     sys.exit(1)
 
+def _get_notes(piece):
+    """piece.notes(), computed once per piece object and then reused"""
+    notes_df = getattr(piece, '_cached_notes', None)
+    if notes_df is None:
+        notes_df = piece.notes()
+        piece._cached_notes = notes_df
+    return notes_df
+
 def test_single_piece_approach():
     """Test extracting notes from a single piece using importScore"""
     print("\n=== Testing Single Piece Approach ===")
@@ -68,7 +75,7 @@ def test_single_piece_approach():
         
         # Try to get notes
         try:
-            notes_df = piece.notes()
+            notes_df = _get_notes(piece)
             print(f"✓ Successfully extracted notes")
             print(f"  Notes DataFrame shape: {notes_df.shape}")
             print(f"  Columns: {list(notes_df.columns)}")
@@ -121,7 +128,7 @@ def test_corpus_approach():
                 
                 # Try to get notes from the piece
                 try:
-                    notes_df = piece.notes()
+                    notes_df = _get_notes(piece)
                     print(f"✓ Successfully extracted notes from piece")
                     print(f"  Notes DataFrame shape: {notes_df.shape}")
                     
@@ -138,7 +145,9 @@ def test_corpus_approach():
         if ImportedPiece:
             print("\nTrying batch method...")
             try:
-                func = ImportedPiece.notes
+                # The batch runs over the same corpus.scores, so pieces whose notes
+                # were already extracted above are not walked a second time
+                func = _get_notes
                 list_of_dfs = corpus.batch(func, metadata=True)
                 print(f"✓ Successfully used batch method")
                 print(f"  Number of DataFrames returned: {len(list_of_dfs)}")
@@ -4,29 +4,82 @@ Test script to compare the effects of end=True vs end=False in melodic intervals
 This script will show the differences in how intervals are positioned and matched.
 """
 
+import importlib.util
 import os
 import sys
+import numpy as np
 import pandas as pd
 
 # Add the core directory to the path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from core.db.db import PiecesDB
 from core.crim_cache_manager import cache_manager
+from _db_helpers import get_notes_from_db, nearest_onsets
 
-try:
-    import crim_intervals
-    from crim_intervals import CorpusBase
-    CRIM_INTERVALS_AVAILABLE = True
-except ImportError:
+# crim_intervals pulls in music21, which is slow to import; only check that it
+# is installed here and import it when a score is actually loaded
+CRIM_INTERVALS_AVAILABLE = importlib.util.find_spec('crim_intervals') is not None
+if not CRIM_INTERVALS_AVAILABLE:
     print("❌ crim_intervals library not available")
-    CRIM_INTERVALS_AVAILABLE = False
 
-def test_end_parameter_effects():
-    """Test the differences between end=True and end=False"""
+# Where the extracted DataFrames are kept in the CRIM cache between runs
+END_TEST_STAGE = 'end_parameter_test'
+END_TEST_SET = 'default'
+END_TEST_FRAMES = ['notes', 'melodic_end_true', 'melodic_end_false',
+                   'detail_end_true', 'detail_end_false']
+
+# Display settings for the detail views, applied only around those prints so
+# importers of this module keep pandas' defaults
+DETAIL_DISPLAY_OPTIONS = ('display.max_columns', 20, 'display.width', 200)
+
+def _load_end_test_frames(full_file_path: str, piece_filename: str):
+    """Get the notes / melodic / detail DataFrames, from cache or from CRIM"""
+    piece_key = cache_manager._get_piece_key(piece_filename)
+    cached = cache_manager.load_stage_cache(END_TEST_STAGE, 'pkl', END_TEST_SET, piece_key)
+    if cached and all(key in cached for key in END_TEST_FRAMES):
+        # The frames are only valid for the file they were extracted from:
+        # check its modification time and size, as ingest_pieces does
+        metadata = cached.get('metadata', {})
+        try:
+            stat = os.stat(full_file_path)
+            unchanged = (abs(stat.st_mtime - metadata.get('file_mtime', 0)) < 1
+                         and stat.st_size == metadata.get('file_size'))
+        except OSError:
+            unchanged = False
+        if unchanged:
+            print(f"   - Loaded from cache ({END_TEST_STAGE}/{END_TEST_SET}/{piece_key})")
+            return cached
+        print(f"   - Cache outdated for {piece_filename}, re-extracting...")
     
     if not CRIM_INTERVALS_AVAILABLE:
         print("❌ Cannot test without crim_intervals library")
-        return
+        return None
+    
+    from crim_intervals import CorpusBase
+    piece = CorpusBase([full_file_path]).scores[0]
+    frames = {
+        'notes': piece.notes(),
+        'melodic_end_true': piece.melodic(end=True),
+        'melodic_end_false': piece.melodic(end=False),
+    }
+    # Only the first 10 rows of each detail view are printed, so detailIndex
+    # is run on just those rows
+    for end in ('true', 'false'):
+        melodic = frames[f'melodic_end_{end}'].head(10)
+        frames[f'detail_end_{end}'] = (
+            melodic if melodic.empty
+            else piece.detailIndex(melodic, measure=True, beat=True, offset=True)
+        )
+    
+    stat = os.stat(full_file_path)
+    cache_manager.save_stage_cache(END_TEST_STAGE, 'pkl', END_TEST_SET, piece_key, frames,
+                                   {'filename': piece_filename,
+                                    'file_mtime': stat.st_mtime,
+                                    'file_size': stat.st_size})
+    return frames
+
+def test_end_parameter_effects():
+    """Test the differences between end=True and end=False"""
     
     # Get a test piece from database
     db = PiecesDB()
@@ -54,12 +107,13 @@ def test_end_parameter_effects():
     try:
         print(f"\n📊 Creating corpus and extracting data...")
         
-        # Create corpus
-        corpus = CorpusBase([full_file_path])
-        piece = corpus.scores[0]
+        # Parse with CRIM only when the cache has no copy of this piece
+        frames = _load_end_test_frames(full_file_path, piece_filename)
+        if frames is None:
+            return
         
         # Get basic notes first for reference
-        notes_df = piece.notes()
+        notes_df = frames['notes']
         print(f"   - Notes DataFrame shape: {notes_df.shape}")
         print(f"   - Voice columns: {list(notes_df.columns)}")
         
@@ -72,7 +126,7 @@ def test_end_parameter_effects():
         print(f"="*80)
         
         # Extract melodic intervals with end=True (default)
-        melodic_end_true = piece.melodic(end=True)
+        melodic_end_true = frames['melodic_end_true']
         print(f"   - Melodic intervals (end=True) shape: {melodic_end_true.shape}")
         print(f"   - Columns: {list(melodic_end_true.columns)}")
         
@@ -81,18 +135,17 @@ def test_end_parameter_effects():
             print(f"   Index (onset positions): {melodic_end_true.index[:10].tolist()}")
             
             # Show detailed view
-            detail_true = piece.detailIndex(melodic_end_true, measure=True, beat=True, offset=True)
+            detail_true = frames['detail_end_true']
             print(f"\n📊 Detailed view (end=True) - first 10 rows:")
-            pd.set_option('display.max_columns', None)
-            pd.set_option('display.width', None)
-            print(detail_true.head(10))
+            with pd.option_context(*DETAIL_DISPLAY_OPTIONS):
+                print(detail_true.head(10))
         
         print(f"\n" + "="*80)
         print(f"🧪 TESTING end=False")
         print(f"="*80)
         
         # Extract melodic intervals with end=False
-        melodic_end_false = piece.melodic(end=False)
+        melodic_end_false = frames['melodic_end_false']
         print(f"   - Melodic intervals (end=False) shape: {melodic_end_false.shape}")
         print(f"   - Columns: {list(melodic_end_false.columns)}")
         
@@ -101,9 +154,10 @@ def test_end_parameter_effects():
             print(f"   Index (onset positions): {melodic_end_false.index[:10].tolist()}")
             
             # Show detailed view
-            detail_false = piece.detailIndex(melodic_end_false, measure=True, beat=True, offset=True)
+            detail_false = frames['detail_end_false']
             print(f"\n📊 Detailed view (end=False) - first 10 rows:")
-            print(detail_false.head(10))
+            with pd.option_context(*DETAIL_DISPLAY_OPTIONS):
+                print(detail_false.head(10))
         
         print(f"\n" + "="*80)
         print(f"🔍 COMPARISON ANALYSIS")
@@ -118,20 +172,17 @@ def test_end_parameter_effects():
             print(f"   end=True  onsets: {onsets_true}")
             print(f"   end=False onsets: {onsets_false}")
             
-            # Calculate differences
+            # Calculate differences in one array operation
             min_len = min(len(onsets_true), len(onsets_false))
-            differences = []
-            for i in range(min_len):
-                diff = onsets_true[i] - onsets_false[i]
-                differences.append(diff)
+            differences = (np.asarray(onsets_true[:min_len], dtype=np.float64)
+                           - np.asarray(onsets_false[:min_len], dtype=np.float64))
             
             print(f"\n📊 Onset Differences (end=True - end=False):")
-            print(f"   First 10 differences: {differences[:10]}")
+            print(f"   First 10 differences: {differences[:10].tolist()}")
             
-            if differences:
-                avg_diff = sum(differences) / len(differences)
-                print(f"   Average difference: {avg_diff:.6f}")
-                print(f"   Range: {min(differences):.6f} to {max(differences):.6f}")
+            if differences.size:
+                print(f"   Average difference: {differences.mean():.6f}")
+                print(f"   Range: {differences.min():.6f} to {differences.max():.6f}")
         
         # Test note matching for both approaches
         print(f"\n" + "="*80)
@@ -140,29 +191,41 @@ def test_end_parameter_effects():
         
         # Get notes from database for comparison
         notes_from_db = get_notes_from_db(piece_id)
-        if notes_from_db:
-            voice_1_notes = [n for n in notes_from_db if n['voice'] == 1 and n['type'] == 'Note']
-            voice_1_notes.sort(key=lambda x: x['onset'])
+        if not notes_from_db.empty:
+            voice_1_notes = notes_from_db[
+                (notes_from_db['voice'] == 1) & (notes_from_db['type'] == 'Note')
+            ].sort_values('onset')
+            
+            # Packed once and shared by both matching tests below
+            voice_1_onsets = voice_1_notes['onset'].to_numpy(dtype=np.float64)
+            voice_1_ids = voice_1_notes['note_id'].to_numpy(dtype=np.int64)
+            voice_1_names = voice_1_notes['name'].to_numpy()
             
             print(f"\n🎵 Voice 1 notes from database (first 10):")
-            for i, note in enumerate(voice_1_notes[:10]):
+            for i, note in enumerate(voice_1_notes.head(10).to_dict('records')):
                 print(f"   {i+1:2d}. onset={note['onset']:6.3f}, note_id={note['note_id']:3d}, name={note['name']}")
             
             # Test matching for end=True
             print(f"\n🧪 Testing note matching for end=True intervals:")
-            test_note_matching_for_intervals(piece_id, melodic_end_true, voice_1_notes, "end=True")
+            test_note_matching_for_intervals(piece_id, melodic_end_true, voice_1_onsets,
+                                             voice_1_ids, voice_1_names, "end=True")
             
             # Test matching for end=False
             print(f"\n🧪 Testing note matching for end=False intervals:")
-            test_note_matching_for_intervals(piece_id, melodic_end_false, voice_1_notes, "end=False")
+            test_note_matching_for_intervals(piece_id, melodic_end_false, voice_1_onsets,
+                                             voice_1_ids, voice_1_names, "end=False")
         
     except Exception as e:
         print(f"❌ Error during testing: {e}")
         import traceback
         traceback.print_exc()
 
-def test_note_matching_for_intervals(piece_id: int, intervals_df, voice_notes: list, label: str):
-    """Test note matching for a specific intervals DataFrame"""
+def test_note_matching_for_intervals(piece_id: int, intervals_df, onsets_arr: np.ndarray,
+                                     ids_arr: np.ndarray, names: np.ndarray, label: str):
+    """Test note matching for a specific intervals DataFrame
+    
+    onsets_arr, ids_arr and names describe one voice's notes sorted by onset.
+    """
     
     if intervals_df.empty:
         print(f"   ❌ No intervals to test for {label}")
@@ -176,69 +239,41 @@ def test_note_matching_for_intervals(piece_id: int, intervals_df, voice_notes: l
     
     first_voice_col = voice_columns[0]
     
+    if onsets_arr.size == 0:
+        print(f"   ❌ No database notes to match for {label}")
+        return
+    
     # Test first 5 intervals
     matches_found = 0
     total_tested = 0
+    tolerance = 0.001
+    
+    # Plain values from the index and the voice column; no Series per row.
+    # Rows without an interval in this voice are masked out up front
+    test_onsets = intervals_df.index[:5].to_numpy(dtype=np.float64)
+    test_values = intervals_df[first_voice_col].to_numpy(dtype=object)[:5]
+    valid = pd.notna(test_values) & (test_values != '')
+    test_onsets, test_values = test_onsets[valid], test_values[valid]
+    
+    # The notes are sorted by onset, so the nearest note to every interval
+    # onset is found by binary search instead of a scan per interval
+    nearest, diffs = nearest_onsets(onsets_arr, test_onsets)
     
     print(f"   🔍 Testing first 5 intervals from {first_voice_col}:")
     
-    for i, (onset, row) in enumerate(intervals_df.head(5).iterrows()):
-        interval_value = row[first_voice_col]
-        
-        if pd.isna(interval_value) or interval_value == '':
-            continue
-        
+    for i, (onset, interval_value) in enumerate(zip(test_onsets, test_values)):
         total_tested += 1
+        k = nearest[i]
         
-        # Try to find matching note
-        tolerance = 0.001
-        matched_notes = []
-        
-        for note in voice_notes:
-            if abs(note['onset'] - onset) <= tolerance:
-                matched_notes.append(note)
-        
-        if matched_notes:
+        if diffs[i] <= tolerance:
             matches_found += 1
-            note = matched_notes[0]
-            print(f"     ✅ Onset {onset:6.3f}: interval={interval_value:>8s} → matched note_id={note['note_id']:3d} ({note['name']})")
+            print(f"     ✅ Onset {onset:6.3f}: interval={interval_value:>8s} → matched note_id={ids_arr[k]:3d} ({names[k]})")
         else:
-            # Find closest note
-            closest_note = min(voice_notes, key=lambda n: abs(n['onset'] - onset))
-            diff = abs(closest_note['onset'] - onset)
-            print(f"     ❌ Onset {onset:6.3f}: interval={interval_value:>8s} → no match (closest: {closest_note['onset']:6.3f}, diff={diff:.3f})")
+            print(f"     ❌ Onset {onset:6.3f}: interval={interval_value:>8s} → no match (closest: {onsets_arr[k]:6.3f}, diff={diffs[i]:.3f})")
     
     match_rate = (matches_found / total_tested * 100) if total_tested > 0 else 0
     print(f"   📊 {label} matching rate: {matches_found}/{total_tested} ({match_rate:.1f}%)")
 
-def get_notes_from_db(piece_id: int):
-    """Get all notes for a piece from database"""
-    db = PiecesDB()
-    
-    try:
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT note_id, piece_id, voice, onset, duration, measure, beat, 
-                   pitch, name, step, octave, `alter`, type, staff, tie
-            FROM notes 
-            WHERE piece_id = ? 
-            ORDER BY voice, onset
-        """, (piece_id,))
-        
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        notes = [dict(zip(columns, row)) for row in rows]
-        
-        conn.close()
-        return notes
-        
-    except Exception as e:
-        print(f"❌ Error retrieving notes: {e}")
-        return []
-
 def analyze_interval_patterns():
     """Analyze the pattern differences between end=True and end=False"""
     
@@ -6,12 +6,14 @@ This script will help identify why notes are not being matched properly.
 
 import os
 import sys
+import numpy as np
 import pandas as pd
 
 # Add the core directory to the path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from core.db.db import PiecesDB
 from core.crim_cache_manager import cache_manager
+from _db_helpers import get_notes_from_db, nearest_onsets
 
 def test_note_matching():
     """Test note matching logic for a specific piece"""
@@ -38,7 +40,7 @@ def test_note_matching():
     print("\n📊 Getting notes from database...")
     notes = get_notes_from_db(piece_id)
     
-    if not notes:
+    if notes.empty:
         print("❌ No notes found in database for this piece.")
         return
     
@@ -46,7 +48,7 @@ def test_note_matching():
     
     # Print first few notes for inspection
     print("\n🔍 First 10 notes from database:")
-    for i, note in enumerate(notes[:10]):
+    for i, note in enumerate(notes.head(10).to_dict('records')):
         print(f"  {i+1}. note_id={note['note_id']}, voice={note['voice']}, "
               f"onset={note['onset']}, type={note['type']}, name={note['name']}")
     
@@ -78,9 +80,12 @@ def test_note_matching():
     # Step 4: Test matching for each voice
     print(f"\n🎭 Testing note matching by voice:")
     
-    # Get unique voices from database notes
-    db_voices = set(note['voice'] for note in notes if note['type'] == 'Note')
-    print(f"   - Voices in database: {sorted(db_voices)}")
+    # Filter to pitched notes once; voices and per-voice notes both come from it
+    note_rows = notes[notes['type'] == 'Note']
+    
+    # Get unique voices from database notes (np.unique returns them sorted)
+    db_voices = np.unique(note_rows['voice'].dropna().to_numpy())
+    print(f"   - Voices in database: {db_voices.tolist()}")
     
     # Get voice columns from DataFrame
     metadata_cols = ['Measure', 'Beat', 'Offset', 'Composer', 'Title', 'Date']
@@ -88,19 +93,18 @@ def test_note_matching():
     print(f"   - Voice columns in DataFrame: {df_voice_columns}")
     
     # Test matching for first voice
-    if db_voices and df_voice_columns:
-        test_voice = sorted(db_voices)[0]
+    if db_voices.size and df_voice_columns:
+        test_voice = db_voices[0]
         print(f"\n🧪 Testing matching for voice {test_voice}:")
         
         # Get notes for this voice from database
-        voice_notes_db = [note for note in notes if note['voice'] == test_voice and note['type'] == 'Note']
-        voice_notes_db.sort(key=lambda x: x['onset'])
+        voice_notes_db = note_rows[note_rows['voice'] == test_voice].sort_values('onset')
         
         print(f"   - Found {len(voice_notes_db)} notes in database for voice {test_voice}")
         
-        if voice_notes_db:
+        if not voice_notes_db.empty:
             print(f"   - First 5 notes from database:")
-            for i, note in enumerate(voice_notes_db[:5]):
+            for i, note in enumerate(voice_notes_db.head(5).to_dict('records')):
                 print(f"     {i+1}. onset={note['onset']:.3f}, note_id={note['note_id']}, name={note['name']}")
         
         # Get onset values from DataFrame
@@ -108,33 +112,29 @@ def test_note_matching():
         print(f"   - First 10 onsets from DataFrame: {df_onsets}")
         
         # Test specific matching
-        if voice_notes_db and df_onsets:
+        if not voice_notes_db.empty and df_onsets:
             test_onset = df_onsets[0]
             print(f"\n🎯 Testing match for onset {test_onset}:")
             
+            # Distances computed once; every tolerance below is a mask over them
+            onset_diffs = np.abs(voice_notes_db['onset'].to_numpy(dtype=np.float64) - test_onset)
+            
             tolerance = 0.001
-            matches = []
-            for note in voice_notes_db:
-                if abs(note['onset'] - test_onset) <= tolerance:
-                    matches.append(note)
+            matches = voice_notes_db[onset_diffs <= tolerance]
             
             print(f"   - Found {len(matches)} matches with tolerance {tolerance}")
-            for match in matches:
+            for match in matches.to_dict('records'):
                 print(f"     - note_id={match['note_id']}, onset={match['onset']}, name={match['name']}")
             
             # Try different tolerances
             for tol in [0.01, 0.1, 0.5]:
-                matches = []
-                for note in voice_notes_db:
-                    if abs(note['onset'] - test_onset) <= tol:
-                        matches.append(note)
-                print(f"   - With tolerance {tol}: {len(matches)} matches")
+                print(f"   - With tolerance {tol}: {int(np.count_nonzero(onset_diffs <= tol))} matches")
     
     # Step 5: Compare timing precision
     print(f"\n⏱️  Comparing timing precision:")
     
-    if notes:
-        db_onsets = [note['onset'] for note in notes[:10]]
+    if not notes.empty:
+        db_onsets = notes['onset'].head(10).tolist()
         print(f"   - Database onsets (first 10): {db_onsets}")
         
     if notes_df is not None:
@@ -148,34 +148,6 @@ def test_note_matching():
                 diff = abs(db_onsets[i] - df_onsets[i])
                 print(f"     Position {i}: DB={db_onsets[i]:.6f}, DF={df_onsets[i]:.6f}, diff={diff:.6f}")
 
-def get_notes_from_db(piece_id: int):
-    """Get all notes for a piece from database"""
-    db = PiecesDB()
-    
-    try:
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT note_id, piece_id, voice, onset, duration, measure, beat, 
-                   pitch, name, step, octave, `alter`, type, staff, tie
-            FROM notes 
-            WHERE piece_id = ? 
-            ORDER BY voice, onset
-        """, (piece_id,))
-        
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        notes = [dict(zip(columns, row)) for row in rows]
-        
-        conn.close()
-        return notes
-        
-    except Exception as e:
-        print(f"❌ Error retrieving notes: {e}")
-        return []
-
 def test_matching_algorithm(piece_id: int, voice: int, onset: float):
     """Test the specific matching algorithm"""
     print(f"\n🔬 Testing matching algorithm:")
@@ -186,16 +158,16 @@ def test_matching_algorithm(piece_id: int, voice: int, onset: float):
     notes = get_notes_from_db(piece_id)
     
     # Filter notes for the specific voice
-    voice_notes = [note for note in notes if note['voice'] == voice and note['type'] == 'Note']
+    voice_notes = notes[(notes['voice'] == voice) & (notes['type'] == 'Note')]
     
-    if not voice_notes:
+    if voice_notes.empty:
         print(f"   ❌ No notes found for voice {voice}")
         return None, None
     
     print(f"   ✅ Found {len(voice_notes)} notes for voice {voice}")
     
     # Sort by onset to ensure proper order
-    voice_notes.sort(key=lambda x: x['onset'])
+    voice_notes = voice_notes.sort_values('onset')
     
     # Find the note at the current onset
     start_note_id = None
@@ -204,33 +176,42 @@ def test_matching_algorithm(piece_id: int, voice: int, onset: float):
     tolerance = 0.001
     print(f"   🎯 Searching with tolerance: {tolerance}")
     
-    for i, note in enumerate(voice_notes):
-        diff = abs(note['onset'] - onset)
-        print(f"      Note {i}: onset={note['onset']:.6f}, diff={diff:.6f}, note_id={note['note_id']}")
+    # Binary search for the nearest note; only its neighbours are printed
+    onsets_arr = voice_notes['onset'].to_numpy(dtype=np.float64)
+    note_ids = voice_notes['note_id'].to_numpy(dtype=np.int64)
+    # Next note_id at every position (-1 after the last note)
+    next_ids = np.append(note_ids[1:], -1)
+    nearest, diffs = nearest_onsets(onsets_arr, np.array([onset], dtype=np.float64))
+    i, diff = int(nearest[0]), float(diffs[0])
+    
+    for j in range(max(i - 1, 0), min(i + 2, len(voice_notes))):
+        note = voice_notes.iloc[j]
+        print(f"      Note {j}: onset={note['onset']:.6f}, diff={abs(note['onset'] - onset):.6f}, note_id={note['note_id']}")
+    
+    if diff <= tolerance:
+        start_note_id = int(note_ids[i])
+        print(f"      ✅ Match found! note_id={start_note_id}")
         
-        if diff <= tolerance:
-            start_note_id = note['note_id']
-            print(f"      ✅ Match found! note_id={start_note_id}")
-            
-            # Get next note
-            if i + 1 < len(voice_notes):
-                next_note_id = voice_notes[i + 1]['note_id']
-                print(f"      ✅ Next note: note_id={next_note_id}")
-            else:
-                print(f"      ⚠️  No next note available")
-            break
+        # Get next note
+        if next_ids[i] >= 0:
+            next_note_id = int(next_ids[i])
+            print(f"      ✅ Next note: note_id={next_note_id}")
+        else:
+            print(f"      ⚠️  No next note available")
     
     if start_note_id is None:
         print(f"   ❌ No match found with tolerance {tolerance}")
         
-        # Try larger tolerance
+        # Try larger tolerance; distances are computed once for all of them
+        onset_diffs = np.abs(onsets_arr - onset)
         for tol in [0.01, 0.1, 0.5]:
             print(f"   🔍 Trying tolerance {tol}:")
-            for i, note in enumerate(voice_notes):
-                diff = abs(note['onset'] - onset)
-                if diff <= tol:
-                    print(f"      ✅ Would match with tolerance {tol}: note_id={note['note_id']}, diff={diff:.6f}")
-                    break
+            # First note (in onset order) within tolerance
+            within = onset_diffs <= tol
+            if within.any():
+                k = int(within.argmax())
+                print(f"      ✅ Would match with tolerance {tol}: note_id={note_ids[k]}, "
+                      f"diff={onset_diffs[k]:.6f}")
             else:
                 print(f"      ❌ Still no match with tolerance {tol}")
     
@@ -1,54 +1,117 @@
-import xml.etree.ElementTree as ET
 import os
 import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# lxml (libxml2) parses in C; the stdlib API is compatible here
+try:
+    from lxml import etree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'core'))
 from db.db import PiecesDB
 
-def analyze_musicxml_structure(file_path):
-    """Analyze MusicXML file structure to check for xml:id attributes"""
+# Clark-notation key of the xml:id attribute, built once rather than per element
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+XMLID_KEY = '{%s}id' % XML_NS
+
+# Quick mode stops once this many notes (and 5 note ids) have been seen
+QUICK_MAX_NOTES = 1000
+
+def _scan_xmlids(file_path, max_notes=None):
+    """
+    Count notes and xml:id attributes in a MusicXML file.
+    
+    Returns the result dict and the report lines instead of printing, so it
+    can run in a worker process without interleaving output. With max_notes,
+    parsing stops as soon as max_notes notes and 5 note ids have been seen
+    and the result is flagged as truncated.
+    """
     try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
+        total_notes = 0
+        notes_with_id = 0
+        total_with_id = 0
+        first_note_ids = []
+        truncated = False
+        root = None
         
-        print(f"\n=== Analyzing {os.path.basename(file_path)} ===")
-        print(f"Root element: {root.tag}")
+        # One streaming pass counts notes and xml:id attributes together;
+        # notes and measures are cleared once counted so the tree stays small
+        # Quick mode also listens for 'start' to catch the root element, since
+        # iterparse only sets context.root once the whole file has been read
+        events = ('start', 'end') if max_notes else ('end',)
+        context = ET.iterparse(file_path, events=events)
+        for event, elem in context:
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            xml_id = elem.get(XMLID_KEY)
+            if xml_id is not None:
+                total_with_id += 1
+            if elem.tag == 'note':
+                total_notes += 1
+                if xml_id is not None:
+                    notes_with_id += 1
+                    if len(first_note_ids) < 5:
+                        first_note_ids.append(xml_id)
+                elem.clear()
+                if max_notes and total_notes >= max_notes and len(first_note_ids) >= 5:
+                    truncated = True
+                    break
+            elif elem.tag == 'measure':
+                elem.clear()
+        if root is None:
+            root = context.root
         
-        # Check for xml:id attributes in note elements
-        notes_with_id = root.findall('.//note[@xml:id]', {'xml': 'http://www.w3.org/XML/1998/namespace'})
-        notes_without_id = root.findall('.//note')
+        lines = [
+            f"\n=== Analyzing {os.path.basename(file_path)} ===",
+            f"Root element: {root.tag}",
+            f"Total notes: {total_notes}",
+            f"Notes with xml:id: {notes_with_id}",
+        ]
         
-        print(f"Total notes: {len(notes_without_id)}")
-        print(f"Notes with xml:id: {len(notes_with_id)}")
-        
-        if notes_with_id:
-            print("\nFirst 5 notes with xml:id:")
-            for i, note in enumerate(notes_with_id[:5]):
-                xml_id = note.get('{http://www.w3.org/XML/1998/namespace}id')
-                print(f"  Note {i+1}: xml:id='{xml_id}'")
+        if first_note_ids:
+            lines.append("\nFirst 5 notes with xml:id:")
+            for i, xml_id in enumerate(first_note_ids):
+                lines.append(f"  Note {i+1}: xml:id='{xml_id}'")
         
         # Check for other elements with xml:id
-        all_with_id = root.findall('.//*[@xml:id]', {'xml': 'http://www.w3.org/XML/1998/namespace'})
-        print(f"Total elements with xml:id: {len(all_with_id)}")
+        lines.append(f"Total elements with xml:id: {total_with_id}")
+        if truncated:
+            lines.append(f"(stopped early after {total_notes} notes)")
         
         return {
-            'total_notes': len(notes_without_id),
-            'notes_with_id': len(notes_with_id),
-            'total_elements_with_id': len(all_with_id),
-            'has_note_ids': len(notes_with_id) > 0
-        }
+            'total_notes': total_notes,
+            'notes_with_id': notes_with_id,
+            'total_elements_with_id': total_with_id,
+            'has_note_ids': notes_with_id > 0,
+            'truncated': truncated
+        }, lines
         
     except Exception as e:
-        print(f"Error analyzing {file_path}: {e}")
-        return None
+        return None, [f"Error analyzing {file_path}: {e}"]
 
-def main():
+def analyze_musicxml_structure(file_path):
+    """Analyze MusicXML file structure to check for xml:id attributes"""
+    result, lines = _scan_xmlids(file_path)
+    print("\n".join(lines))
+    return result
+
+def analyze_quick(file_path, max_notes=QUICK_MAX_NOTES):
+    """Like analyze_musicxml_structure, but stops early once note ids are confirmed"""
+    result, lines = _scan_xmlids(file_path, max_notes)
+    print("\n".join(lines))
+    return result
+
+def main(quick=False):
     """Check MusicXML structure for all pieces in database"""
     db = PiecesDB()
     pieces = db.get_all_pieces()
     
-    results = []
-    
+    # Resolve the files first, then parse them in parallel worker processes
+    jobs = []
     for piece in pieces[:3]:  # Check first 3 pieces
         file_path = piece.get('path')
         if file_path:
@@ -58,16 +121,35 @@ def main():
                 file_path = os.path.join(base_path, file_path)
             
             if os.path.exists(file_path):
-                result = analyze_musicxml_structure(file_path)
+                jobs.append((piece, file_path))
+    
+    max_notes = QUICK_MAX_NOTES if quick else None
+    results = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(_scan_xmlids, file_path, max_notes) for _, file_path in jobs]
+            # Workers parse concurrently; reports are printed in piece order
+            for (piece, _), future in zip(jobs, futures):
+                result, lines = future.result()
+                print("\n".join(lines))
                 if result:
                     result['piece_id'] = piece['piece_id']
                     result['filename'] = piece['filename']
                     results.append(result)
     
-    print(f"\n=== Summary ===")
-    for result in results:
-        print(f"Piece {result['piece_id']} ({result['filename']}): "
-              f"{'HAS' if result['has_note_ids'] else 'NO'} note xml:id attributes")
+    # The summary is assembled first and written in one call
+    lines = ["\n=== Summary ==="]
+    lines.extend(
+        f"Piece {result['piece_id']} ({result['filename']}): "
+        f"{'HAS' if result['has_note_ids'] else 'NO'} note xml:id attributes"
+        f"{' (partial scan)' if result['truncated'] else ''}"
+        for result in results
+    )
+    sys.stdout.write("\n".join(lines) + "\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Check MusicXML files for note xml:id attributes')
+    parser.add_argument('--quick', action='store_true',
+                        help=f'Stop each file once {QUICK_MAX_NOTES} notes and 5 note ids have been seen')
+    args = parser.parse_args()
+    main(quick=args.quick)
\ No newline at end of file
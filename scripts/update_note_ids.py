@@ -9,13 +9,49 @@ Uses optimized batch processing for fast performance on large datasets.
 
 import os
 import sys
+import sqlite3
 import argparse
 
 # Add the project root to the path
 project_root = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(project_root)
 
-from core.utils.note_id_updater import NoteIdUpdater
+from core.utils.note_id_updater import ANALYSIS_TABLES, NoteIdUpdater, note_id_join_update_sql
+
+
+def update_note_ids_sql(db_path: str, tables, piece_id=None, tolerance: float = 0.001) -> dict:
+    """
+    Fill NULL note_ids with one UPDATE ... FROM per table, bypassing NoteIdUpdater.
+    
+    Each statement range-seeks idx_notes_lookup for candidates and keeps the
+    nearest note per row, so matching and writing happen entirely inside SQLite.
+    All tables are updated in a single transaction.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_notes_lookup ON notes(piece_id, voice, onset)"
+        )
+        
+        results = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table_name in tables:
+                cursor = conn.execute(note_id_join_update_sql(table_name, tolerance, piece_id),
+                                      {'tolerance': tolerance, 'piece_id': piece_id})
+                results[table_name] = cursor.rowcount
+                print(f"{table_name}: {cursor.rowcount} records updated (SQL path)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+    finally:
+        conn.close()
 
 
 def main():
@@ -39,6 +75,9 @@ Examples:
   
   # Use custom tolerance for onset matching
   python scripts/update_note_ids.py --tolerance 0.01
+  
+  # Match and update entirely in SQL, one statement per table
+  python scripts/update_note_ids.py --sql-path
         """
     )
     
@@ -52,6 +91,8 @@ Examples:
                        help='Which table(s) to update (default: all)')
     parser.add_argument('--batch-size', type=int, default=5000,
                        help='Batch size for processing large datasets (default: 5000)')
+    parser.add_argument('--sql-path', action='store_true',
+                       help='Update with one UPDATE ... FROM statement per table, bypassing NoteIdUpdater')
     
     args = parser.parse_args()
     
@@ -61,20 +102,23 @@ Examples:
         print(f"Piece ID: {args.piece_id}")
     print(f"Tolerance: {args.tolerance}")
     print(f"Batch Size: {args.batch_size}")
+    if args.sql_path:
+        print("Mode: SQL path")
     print()
     
+    updater = NoteIdUpdater()
     try:
-        updater = NoteIdUpdater()
+        tables = ANALYSIS_TABLES if args.table == 'all' else [args.table]
         
-        # Update note_ids using optimized batch processing
-        if args.table == 'all':
+        if args.sql_path:
+            results = update_note_ids_sql(updater.db_path, tables, args.piece_id, args.tolerance)
+        else:
+            # One updater connection (PRAGMAs applied once, statement cache kept
+            # warm) serves every table
             results = {}
-            for table_name in ['melodic_intervals', 'melodic_ngrams', 'melodic_entries']:
+            for table_name in tables:
                 count = updater.update_note_ids_batch_optimized(table_name, args.piece_id, args.tolerance, args.batch_size)
                 results[table_name] = count
-        elif args.table in ['melodic_intervals', 'melodic_ngrams', 'melodic_entries']:
-            count = updater.update_note_ids_batch_optimized(args.table, args.piece_id, args.tolerance, args.batch_size)
-            results = {args.table: count}
         
         print(f"\n=== Final Results ===")
         total_updated = sum(results.values()) if isinstance(results, dict) else results
@@ -93,6 +137,8 @@ Examples:
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
+    finally:
+        updater.close()
 
 
 if __name__ == "__main__":
@@ -11,25 +11,27 @@ def update_schema_add_offset():
     if not os.path.exists(db_path):
         print(f"Database not found at {db_path}")
         return False
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        # Autocommit mode: the ALTER runs in the explicit transaction below
+        conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
         cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(notes)")
-        columns = cursor.fetchall()
-        column_names = [column[1] for column in columns]
-        if 'offset' not in column_names:
-            print("Adding offset column to notes table...")
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
             cursor.execute("ALTER TABLE notes ADD COLUMN offset REAL")
             print("✓ Added offset column to notes table")
-        else:
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e):
+                raise
             print("✓ offset column already exists in notes table")
-        conn.commit()
+        cursor.execute("COMMIT")
         conn.close()
         print("\n✓ Database schema update completed!")
         return True
     except Exception as e:
         print(f"Error: {e}")
         if conn:
+            conn.rollback()
             conn.close()
         return False
 if __name__ == "__main__":
@@ -20,35 +20,24 @@ def update_database_schema():
         print(f"Database not found at {db_path}")
         return False
     
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        # Autocommit mode: the ALTERs run in the explicit transaction below
+        conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
         cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
         
-        # Check if voice_name column already exists in notes table
-        cursor.execute("PRAGMA table_info(notes)")
-        columns = cursor.fetchall()
-        column_names = [column[1] for column in columns]
+        # Add voice_name to each table; an existing column is reported, not re-added
+        for table in ('notes', 'melodic_intervals'):
+            try:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN voice_name TEXT")
+                print(f"✓ Added voice_name column to {table} table")
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise
+                print(f"✓ voice_name column already exists in {table} table")
         
-        if 'voice_name' not in column_names:
-            print("Adding voice_name column to notes table...")
-            cursor.execute("ALTER TABLE notes ADD COLUMN voice_name TEXT")
-            print("✓ Added voice_name column to notes table")
-        else:
-            print("✓ voice_name column already exists in notes table")
-        
-        # Check if voice_name column already exists in melodic_intervals table
-        cursor.execute("PRAGMA table_info(melodic_intervals)")
-        columns = cursor.fetchall()
-        column_names = [column[1] for column in columns]
-        
-        if 'voice_name' not in column_names:
-            print("Adding voice_name column to melodic_intervals table...")
-            cursor.execute("ALTER TABLE melodic_intervals ADD COLUMN voice_name TEXT")
-            print("✓ Added voice_name column to melodic_intervals table")
-        else:
-            print("✓ voice_name column already exists in melodic_intervals table")
-        
-        conn.commit()
+        cursor.execute("COMMIT")
         conn.close()
         
         print("\n✓ Database schema update completed successfully!")
@@ -57,11 +46,13 @@ def update_database_schema():
     except sqlite3.Error as e:
         print(f"Error updating database schema: {e}")
         if conn:
+            conn.rollback()
             conn.close()
         return False
     except Exception as e:
         print(f"Unexpected error: {e}")
         if conn:
+            conn.rollback()
             conn.close()
         return False
 